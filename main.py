@@ -2,7 +2,18 @@ import time
 import io
 import re
 import os
-from PIL import Image
+import sys
+import threading
+import multiprocessing
+import hashlib
+import json
+import asyncio
+import contextlib
+import base64
+import logging
+import logging.handlers
+import numpy as np
+from PIL import Image, ImageOps
 import pytesseract
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -12,129 +23,716 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 import concurrent.futures
 
-def extract_image_urls_from_html(html_content):
-    """Extract image URLs and timestamps from HTML"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    image_urls = []
+try:
+    import ahocorasick
+except ImportError:  # Optional: fall back to the compiled regexes below
+    ahocorasick = None
+
+try:
+    import aiohttp
+except ImportError:  # Optional: fall back to the shared requests session in threads
+    aiohttp = None
+
+try:
+    import numba
+except ImportError:  # Optional: fall back to NumPy / regex implementations
+    numba = None
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:  # Optional: fall back to BeautifulSoup
+    HTMLParser = None
+
+try:
+    import imagehash
+except ImportError:  # Optional: fall back to a NumPy block hash
+    imagehash = None
+
+try:
+    import tesserocr
+except ImportError:  # Optional: fall back to spawning tesseract via pytesseract
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+# Compiled once at import time instead of on every processed image
+ATTEND_RE = re.compile(r'attendance code|clicker question', re.IGNORECASE)
+# Possessive capital runs (Python 3.11+) stop the engine from retrying shorter
+# prefixes of a run, which can never match since the next character is a capital
+_CAPS_RUN = r'[A-Z]{2,}+' if sys.version_info >= (3, 11) else r'[A-Z]{2,}'
+# Pattern for words like "LUT DESERT" - uppercase words with spaces between
+# that aren't part of URLs or other non-code text
+CODE_RE = re.compile(rf'(?<![a-zA-Z0-9:/.]){_CAPS_RUN}(?: {_CAPS_RUN})*(?![a-zA-Z0-9:/.])')
+# Video frames require at least two words to cut down on false positives
+VIDEO_CODE_RE = re.compile(rf'(?<![a-zA-Z0-9:/.]){_CAPS_RUN}(?: {_CAPS_RUN})+(?![a-zA-Z0-9:/.])')
+FALLBACK_LINE_RE = re.compile(r'^[A-Z\s]+$')
+URL_TERMS = ('http', 'www', 'join', 'com')
+TIMESTAMP_RE = re.compile(r'(\d+):(\d+)')
+
+def _build_automaton(keys):
+    """Build an Aho-Corasick automaton over lowercase keys, or None if unavailable"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for key in keys:
+        automaton.add_word(key, key)
+    automaton.make_automaton()
+    return automaton
+
+ATTEND_AUTOMATON = _build_automaton(('attendance code', 'clicker question'))
+URL_AUTOMATON = _build_automaton(URL_TERMS)
+
+def has_attendance_marker(text):
+    """Single-pass check for attendance slide indicators in OCR text"""
+    if ATTEND_AUTOMATON is None:
+        return ATTEND_RE.search(text) is not None
+    return next(ATTEND_AUTOMATON.iter(text.lower()), None) is not None
+
+def is_code_candidate(match):
+    """Reject matches that look like pieces of URLs rather than codes"""
+    lowered = match.lower()
+    if URL_AUTOMATON is None:
+        return not any(url_term in lowered for url_term in URL_TERMS)
+    return next(URL_AUTOMATON.iter(lowered), None) is None
+
+def _otsu_threshold_numpy(hist):
+    """Return the grey level that maximises between-class variance of a 256-bin histogram"""
+    hist = hist.astype(np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 0
+    levels = np.arange(256, dtype=np.float64)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    sum_bg = np.cumsum(hist * levels)
+    mean_total = sum_bg[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (mean_total - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.nanargmax(variance)) if np.isfinite(variance).any() else 0
+
+def _otsu_threshold_loop(hist):
+    """Single-pass Otsu over a 256-bin histogram, written for Numba to compile"""
+    total = 0.0
+    mean_total = 0.0
+    for level in range(256):
+        total += hist[level]
+        mean_total += level * hist[level]
+    weight_bg = 0.0
+    sum_bg = 0.0
+    best_variance = 0.0
+    best_level = 0
+    for level in range(256):
+        weight_bg += hist[level]
+        if weight_bg == 0.0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0.0:
+            break
+        sum_bg += level * hist[level]
+        mean_diff = sum_bg / weight_bg - (mean_total - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * mean_diff * mean_diff
+        if variance > best_variance:
+            best_variance = variance
+            best_level = level
+    return best_level
+
+def _has_upper_run_loop(buf):
+    """True if the byte buffer contains two consecutive ASCII capitals"""
+    previous_upper = False
+    for byte in buf:
+        is_upper = 65 <= byte <= 90
+        if is_upper and previous_upper:
+            return True
+        previous_upper = is_upper
+    return False
+
+UPPER_RUN_RE = re.compile(r'[A-Z]{2}')
+
+if numba is not None:
+    otsu_threshold = numba.njit(cache=True, fastmath=True)(_otsu_threshold_loop)
+    _has_upper_run = numba.njit(cache=True)(_has_upper_run_loop)
     
-    # Find all img tags with data-src attribute
-    img_tags = soup.find_all('img', attrs={'data-src': True})
+    def has_upper_run(text):
+        """Cheap prefilter: codes need at least two consecutive capitals"""
+        return _has_upper_run(np.frombuffer(text.encode('utf-8'), dtype=np.uint8))
+else:
+    otsu_threshold = _otsu_threshold_numpy
     
-    for img in img_tags:
-        # Extract the URL from data-src attribute
-        url = img['data-src']
-        # Get the timestamp from the parent li element if available
-        timestamp = "unknown"
+    def has_upper_run(text):
+        """Cheap prefilter: codes need at least two consecutive capitals"""
+        return UPPER_RUN_RE.search(text) is not None
+
+def find_codes(pattern, text):
+    """Return code-pattern matches in text, skipping the regex when no capitals run exists"""
+    if not has_upper_run(text):
+        return []
+    return pattern.findall(text)
+
+# Slide text stays legible at this size, and tesseract does less work on smaller inputs
+OCR_MAX_SIDE = 1024
+
+def preprocess_for_ocr(image):
+    """Convert to grayscale, downscale and binarize with Otsu so tesseract skips its own preprocessing"""
+    gray = image.convert('L')
+    if max(gray.size) > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / max(gray.size)
+        target = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(target, Image.LANCZOS)
+    gray = ImageOps.autocontrast(gray)
+    arr = np.asarray(gray)
+    hist = np.bincount(arr.ravel(), minlength=256)
+    threshold = otsu_threshold(hist)
+    binary = (arr > threshold).astype(np.uint8) * 255
+    return Image.fromarray(binary)
+
+# Slides carry sparse text, which tesseract segments faster in sparse-text mode (PSM 11)
+TESSERACT_CONFIG = '--psm 11'
+
+# One tesseract API per thread so the language model is loaded only once
+_ocr_local = threading.local()
+
+def get_ocr_api():
+    """Return this thread's resident tesseract API, creating it on first use"""
+    api = getattr(_ocr_local, 'api', None)
+    if api is None:
+        api = tesserocr.PyTessBaseAPI(lang='eng', psm=tesserocr.PSM.SPARSE_TEXT)
+        _ocr_local.api = api
+    return api
+
+def init_ocr_worker():
+    """Load the tesseract model when an OCR worker process starts"""
+    if tesserocr is not None:
+        get_ocr_api()
+
+def ocr_image(image):
+    """Run OCR on a PIL image, reusing a resident tesseract API when available"""
+    return recognize_binary(preprocess_for_ocr(image))
+
+def recognize_binary(image):
+    """Run tesseract on an image already passed through preprocess_for_ocr"""
+    if tesserocr is None:
+        return pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
+    api = get_ocr_api()
+    api.SetImage(image)
+    return api.GetUTF8Text()
+
+# Shared session so thumbnail downloads reuse pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=16, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.2),
+))
+
+# Downloads are network-bound, OCR is CPU-bound, so each stage gets its own limit
+DOWNLOAD_CONCURRENCY = 32
+OCR_WORKERS = os.cpu_count() or 4
+PROGRESS_BATCH = 10
+# fork is unsafe once download and writer threads are running
+OCR_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Image files are written by a single background thread so disk I/O stays off the OCR path
+_file_writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+_pending_writes = []
+_created_dirs = set()
+
+def _write_file(filename, data):
+    dirname = os.path.dirname(filename)
+    if dirname and dirname not in _created_dirs:
+        os.makedirs(dirname, exist_ok=True)
+        _created_dirs.add(dirname)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def queue_write(filename, data):
+    """Schedule bytes to be written to filename on the background writer"""
+    _pending_writes.append(_file_writer.submit(_write_file, filename, data))
+
+def flush_writes():
+    """Wait for all queued file writes, reporting any that failed"""
+    while _pending_writes:
+        future = _pending_writes.pop()
+        try:
+            future.result()
+        except OSError as e:
+            logger.warning("Error writing file: %s", e)
+
+# Bump whenever preprocessing changes in a way that alters OCR output
+OCR_PIPELINE_VERSION = 2
+
+def ocr_settings_fingerprint():
+    """Short digest of every setting that affects OCR output"""
+    engine = 'tesserocr' if tesserocr is not None else 'pytesseract'
+    settings = f"{OCR_PIPELINE_VERSION}|{engine}|{TESSERACT_CONFIG}|{OCR_MAX_SIDE}"
+    return hashlib.md5(settings.encode('utf-8')).hexdigest()[:12]
+
+# OCR results keyed by MD5 of the raw image bytes. Only thumbnail results are
+# persisted between runs, in a file named after the current OCR settings so a
+# settings change starts from an empty cache
+OCR_CACHE_FILE = f"thumbnails/ocr_cache_{ocr_settings_fingerprint()}.json"
+_ocr_cache = {}
+_persistent_keys = set()
+_ocr_cache_lock = threading.Lock()
+
+def ocr_cache_key(data):
+    """Cache key for raw image bytes"""
+    return hashlib.md5(data).hexdigest()
+
+def get_cached_text(key):
+    """Return cached OCR text for key, or None"""
+    with _ocr_cache_lock:
+        return _ocr_cache.get(key)
+
+def store_cached_text(key, text, persist):
+    """Cache OCR text for key, marking it to be saved to disk when persist is set"""
+    with _ocr_cache_lock:
+        _ocr_cache[key] = text
+        if persist:
+            _persistent_keys.add(key)
+
+def load_ocr_cache():
+    """Load previously computed thumbnail OCR results from disk if present"""
+    try:
+        with open(OCR_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return
+    if not isinstance(cache, dict):
+        return
+    cache = {
+        key: text for key, text in cache.items()
+        if isinstance(key, str) and isinstance(text, str)
+    }
+    with _ocr_cache_lock:
+        _ocr_cache.update(cache)
+        _persistent_keys.update(cache)
+
+def save_ocr_cache():
+    """Write thumbnail OCR results to disk so reruns on the same lecture skip tesseract"""
+    with _ocr_cache_lock:
+        cache = {key: _ocr_cache[key] for key in _persistent_keys}
+    if not cache:
+        return
+    os.makedirs(os.path.dirname(OCR_CACHE_FILE), exist_ok=True)
+    tmp_file = OCR_CACHE_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, OCR_CACHE_FILE)
+
+# Frames are hashed after OCR preprocessing, so the hash follows the binarized text
+# rather than the slide layout. Each hash has its own duplicate threshold, tuned on test
+# slides that share a layout and differ only in text, including a frame where a single
+# code line ("FOX") is revealed: re-encoded copies of one frame stayed within 24 (pHash)
+# / 2 (block hash) bits while the revealed-code frame was at least 168 / 18 bits away
+FRAME_HASH_SIZE = 32
+PHASH_MAX_DISTANCE = 32
+BLOCKHASH_GRID = 96
+BLOCKHASH_INK_LEVEL = 250
+BLOCKHASH_MAX_DISTANCE = 6
+FRAME_HASH_MAX_DISTANCE = PHASH_MAX_DISTANCE if imagehash is not None else BLOCKHASH_MAX_DISTANCE
+
+def perceptual_hash(binary):
+    """Return a hash of a binarized OCR input image as an int"""
+    if imagehash is not None:
+        return int(str(imagehash.phash(binary, hash_size=FRAME_HASH_SIZE)), 16)
+    # Block hash: one bit per cell of a 96x96 grid, set when the cell contains any ink,
+    # so a single added line of text flips a whole row of cells
+    cells = np.asarray(binary.resize((BLOCKHASH_GRID, BLOCKHASH_GRID), Image.BOX), dtype=np.uint8)
+    bits = (cells < BLOCKHASH_INK_LEVEL).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hash_distance(a, b):
+    """Hamming distance between two perceptual hashes"""
+    return bin(a ^ b).count('1')
+
+# An image counts as blank when almost no preview pixels stand out from the background.
+# On test frames, solid, dark and JPEG-noisy backgrounds had 0 such pixels, while
+# the faintest slide (one line of text 3% of the frame height) still had 32
+BLANK_PREVIEW_SIZE = 128
+BLANK_PIXEL_DELTA = 32
+BLANK_MAX_INK_PIXELS = 8
+
+def is_blank_image(data):
+    """Check a 128x128 grayscale preview for pixels that differ from the background"""
+    preview = Image.open(io.BytesIO(data))
+    # For JPEGs, draft lets the decoder scale down via DCT instead of decoding every pixel
+    preview.draft('L', (BLANK_PREVIEW_SIZE, BLANK_PREVIEW_SIZE))
+    pixels = np.asarray(
+        preview.convert('L').resize((BLANK_PREVIEW_SIZE, BLANK_PREVIEW_SIZE), Image.BILINEAR),
+        dtype=np.int16,
+    )
+    ink = np.count_nonzero(np.abs(pixels - int(np.median(pixels))) > BLANK_PIXEL_DELTA)
+    return ink < BLANK_MAX_INK_PIXELS
+
+def ocr_image_bytes(data):
+    """Decode image bytes and run OCR on them; runs inside an OCR worker process
+    
+    Returns None for blank images so the result is not cached.
+    """
+    if is_blank_image(data):
+        return None
+    return ocr_image(Image.open(io.BytesIO(data)))
+
+def prepare_frame_bytes(data):
+    """Decode, binarize and hash a video frame; runs inside an OCR worker process
+    
+    Returns (hash, binarized image) so the image can be handed straight to
+    recognize_binary, or None for blank frames.
+    """
+    if is_blank_image(data):
+        return None
+    binary = preprocess_for_ocr(Image.open(io.BytesIO(data)))
+    return perceptual_hash(binary), binary
+
+def select_thumbnail_images(html_content):
+    """Return (data-src URL, parent li timestamp text or None) for every lazy-loaded img"""
+    if HTMLParser is not None:
+        images = []
+        for img in HTMLParser(html_content).css('img[data-src]'):
+            timestamp = None
+            parent = img.parent
+            if parent is not None and parent.tag == 'li':
+                timestamp_div = parent.css_first('div.thumbnail-timestamp')
+                if timestamp_div is not None:
+                    timestamp = timestamp_div.text()
+            images.append((img.attributes.get('data-src'), timestamp))
+        return images
+    
+    soup = BeautifulSoup(html_content, 'html.parser')
+    images = []
+    for img in soup.find_all('img', attrs={'data-src': True}):
+        timestamp = None
         if img.parent and img.parent.name == 'li':
             timestamp_div = img.parent.find('div', class_='thumbnail-timestamp')
             if timestamp_div:
-                timestamp = timestamp_div.text.strip()
-        
+                timestamp = timestamp_div.text
+        images.append((img['data-src'], timestamp))
+    return images
+
+def select_thumbnail_timestamps(html_content):
+    """Return the timestamp text of every thumbnail li element"""
+    if HTMLParser is not None:
+        timestamp_divs = (
+            thumbnail.css_first('div.thumbnail-timestamp')
+            for thumbnail in HTMLParser(html_content).css('li.thumbnail')
+        )
+        return [div.text() for div in timestamp_divs if div is not None]
+    
+    soup = BeautifulSoup(html_content, 'html.parser')
+    timestamp_divs = (
+        thumbnail.find('div', class_='thumbnail-timestamp')
+        for thumbnail in soup.find_all('li', class_='thumbnail')
+    )
+    return [div.text for div in timestamp_divs if div]
+
+def extract_image_urls_from_html(html_content):
+    """Extract image URLs and timestamps from HTML"""
+    image_urls = []
+    
+    for url, timestamp_text in select_thumbnail_images(html_content):
+        # Use the timestamp from the parent li element if available
+        timestamp = timestamp_text.strip() if timestamp_text is not None else "unknown"
         image_urls.append((url, timestamp))
     
     return image_urls
 
-def download_and_process_image(url_timestamp):
-    """Download image and process it with OCR to find attendance codes"""
-    url, timestamp = url_timestamp
-    
+# Code pattern and saved-file prefix for each image source
+IMAGE_SOURCES = {
+    'thumbnail': (CODE_RE, 'code'),
+    'video': (VIDEO_CODE_RE, 'video_code'),
+}
+
+def process_image_bytes(data, timestamp, text, source='thumbnail'):
+    """Look for attendance codes in OCR text, saving the image only when one is found"""
+    code_re, prefix = IMAGE_SOURCES[source]
     try:
-        # Download the image
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to download image at {timestamp}: {response.status_code}")
+        # Look for attendance slide indicators
+        if not has_attendance_marker(text):
             return None
         
-        # Create a directory for saving images if it doesn't exist
-        os.makedirs("thumbnails", exist_ok=True)
-        
-        # Save the image file for reference
-        filename = f"thumbnails/thumbnail_{timestamp.replace(':', '_')}.jpg"
-        with open(filename, 'wb') as f:
-            f.write(response.content)
+        matches = find_codes(code_re, text)
         
-        # Convert to PIL Image
-        image = Image.open(io.BytesIO(response.content))
+        # Filter out false positives
+        filtered_matches = [
+            match for match in matches if is_code_candidate(match)
+        ]
         
-        # Use OCR to extract text
-        text = pytesseract.image_to_string(image)
-        
-        # Look for attendance slide indicators
-        if re.search(r'attendance code|clicker question', text.lower()):
-            # Pattern for words like "LUT DESERT" - uppercase words with spaces between
-            # that aren't part of URLs or other non-code text
-            code_pattern = r'(?<![a-zA-Z0-9:/.])[A-Z]{2,}(?: [A-Z]{2,})*(?![a-zA-Z0-9:/.])'
-            matches = re.findall(code_pattern, text)
+        if filtered_matches:
+            # Save positive matches to a special directory
+            for match in filtered_matches:
+                code_filename = f"attendance_codes/{prefix}_{match.replace(' ', '_')}_{timestamp.replace(':', '_')}.jpg"
+                queue_write(code_filename, data)
             
-            # Filter out false positives
-            filtered_matches = [
-                match for match in matches 
-                if not any(url_term in match.lower() for url_term in ['http', 'www', 'join', 'com'])
-            ]
-            
-            if filtered_matches:
-                # Save positive matches to a special directory
-                os.makedirs("attendance_codes", exist_ok=True)
-                for _, match in enumerate(filtered_matches):
-                    code_filename = f"attendance_codes/code_{match.replace(' ', '_')}_{timestamp.replace(':', '_')}.jpg"
-                    image.save(code_filename)
-                
-                return (timestamp, filtered_matches, filename)
-            
-            # Fallback for attendance slides without standard pattern
-            if "Insert the following attendance code" in text:
-                # Try to extract the code that appears after this phrase
-                after_prompt = text.split("Insert the following attendance code")[1]
-                lines = after_prompt.split('\n')
-                for line in lines[:5]:  # Check the next few lines
-                    if re.match(r'^[A-Z\s]+$', line.strip()) and len(line.strip()) > 3:
-                        code = line.strip()
-                        # Save the fallback match
-                        os.makedirs("attendance_codes", exist_ok=True)
-                        code_filename = f"attendance_codes/code_fallback_{code.replace(' ', '_')}_{timestamp.replace(':', '_')}.jpg"
-                        image.save(code_filename)
-                        return (timestamp, [code], filename)
+            return (timestamp, filtered_matches, code_filename)
+        
+        # Fallback for attendance slides without standard pattern
+        if "Insert the following attendance code" in text:
+            # Try to extract the code that appears after this phrase
+            after_prompt = text.split("Insert the following attendance code")[1]
+            lines = after_prompt.split('\n')
+            for line in lines[:5]:  # Check the next few lines
+                if FALLBACK_LINE_RE.match(line.strip()) and len(line.strip()) > 3:
+                    code = line.strip()
+                    # Save the fallback match
+                    code_filename = f"attendance_codes/{prefix}_fallback_{code.replace(' ', '_')}_{timestamp.replace(':', '_')}.jpg"
+                    queue_write(code_filename, data)
+                    return (timestamp, [code], code_filename)
         
         return None
     
     except Exception as e:
-        print(f"Error processing image at {timestamp}: {str(e)}")
+        logger.warning("Error processing image at %s: %s", timestamp, e)
         return None
 
-def extract_timestamps_from_thumbnails(html_content):
-    """Extract timestamps from thumbnails HTML for navigating in the video"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    timestamps = []
+async def fetch_image(session, semaphore, url, timestamp):
+    """Download a thumbnail, returning its bytes or None on failure"""
+    async with semaphore:
+        try:
+            if session is None:
+                response = await asyncio.to_thread(SESSION.get, url, timeout=(3, 10))
+                status, data = response.status_code, response.content
+            else:
+                async with session.get(url) as response:
+                    status = response.status
+                    data = await response.read()
+        except Exception as e:
+            logger.warning("Error downloading image at %s: %s", timestamp, e)
+            return None
+    
+    if status != 200:
+        logger.warning("Failed to download image at %s: %s", timestamp, status)
+        return None
+    return data
+
+async def run_ocr_pipeline(executor, timestamps, source, feed):
+    """Feed images through a bounded OCR worker pool and return attendance code matches
     
-    # Find all thumbnail li elements
-    thumbnails = soup.find_all('li', class_='thumbnail')
+    feed(submit, skip) must call ``await submit(idx, data)`` for every image it
+    obtains, passing ``same_as`` for a near-duplicate of an earlier index or
+    ``binary`` when it already has the preprocessed image, and ``skip(idx)`` for
+    images it could not obtain or that need no OCR.
+    """
+    loop = asyncio.get_running_loop()
+    # Bounded so producers cannot run arbitrarily far ahead of OCR
+    queue = asyncio.Queue(maxsize=OCR_WORKERS * 2)
+    pbar = tqdm(total=len(timestamps), mininterval=0.5, smoothing=0.1)
+    completed = 0
     
-    for thumbnail in thumbnails:
-        # Get timestamp
-        timestamp_div = thumbnail.find('div', class_='thumbnail-timestamp')
-        if not timestamp_div:
+    def advance():
+        # Update the progress bar in batches rather than once per image
+        nonlocal completed
+        completed += 1
+        if completed % PROGRESS_BATCH == 0:
+            pbar.update(PROGRESS_BATCH)
+    
+    # Per-image state is kept column-wise and addressed by index
+    raw_bytes = [None] * len(timestamps)
+    texts = [None] * len(timestamps)
+    binaries = [None] * len(timestamps)
+    duplicate_of = {}
+    
+    async def submit(idx, data, same_as=None, binary=None):
+        raw_bytes[idx] = data
+        binaries[idx] = binary
+        if same_as is None:
+            await queue.put(idx)
+        else:
+            duplicate_of[idx] = same_as
+            advance()
+    
+    def skip(idx):
+        advance()
+    
+    async def consume():
+        while True:
+            idx = await queue.get()
+            data = raw_bytes[idx]
+            binary, binaries[idx] = binaries[idx], None
+            try:
+                # Skip OCR for images we have already seen
+                key = ocr_cache_key(data)
+                text = get_cached_text(key)
+                if text is None and binary is not None:
+                    text = await loop.run_in_executor(executor, recognize_binary, binary)
+                elif text is None:
+                    text = await loop.run_in_executor(executor, ocr_image_bytes, data)
+                    # Blank images come back as None and are rechecked on every run
+                    if text is not None:
+                        store_cached_text(key, text, persist=(source == 'thumbnail'))
+                
+                texts[idx] = text
+                # Only images with an attendance marker need their bytes later
+                if text is None or not has_attendance_marker(text):
+                    raw_bytes[idx] = None
+            except Exception as e:
+                raw_bytes[idx] = None
+                logger.warning("Error processing %s: %s", timestamps[idx], e)
+            finally:
+                advance()
+                queue.task_done()
+    
+    consumers = [asyncio.create_task(consume()) for _ in range(OCR_WORKERS)]
+    try:
+        await feed(submit, skip)
+        await queue.join()
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        pbar.update(completed % PROGRESS_BATCH)
+        pbar.close()
+    
+    # Near-duplicates reuse the OCR text of the image they matched
+    for idx, original in duplicate_of.items():
+        texts[idx] = texts[original]
+    
+    # Match codes in a single pass; only matching images are written to disk
+    results = []
+    for idx, data in enumerate(raw_bytes):
+        if data is None or texts[idx] is None:
             continue
+        result = process_image_bytes(data, timestamps[idx], texts[idx], source)
+        if result:
+            results.append(result)
+    return results
+
+async def process_thumbnails(executor, image_urls):
+    """Download thumbnails concurrently and OCR them in the shared worker pool"""
+    semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    
+    async def feed(submit, skip):
+        if aiohttp is None:
+            session_context = contextlib.nullcontext()
+        else:
+            session_context = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=DOWNLOAD_CONCURRENCY),
+                timeout=aiohttp.ClientTimeout(sock_connect=3, sock_read=10),
+            )
+        
+        async def produce(session, idx, url, timestamp):
+            data = await fetch_image(session, semaphore, url, timestamp)
+            if data is None:
+                skip(idx)
+            else:
+                await submit(idx, data)
+        
+        async with session_context as session:
+            await asyncio.gather(*(
+                produce(session, idx, url, timestamp)
+                for idx, (url, timestamp) in enumerate(image_urls)
+            ))
+    
+    timestamps = [timestamp for _, timestamp in image_urls]
+    return await run_ocr_pipeline(executor, timestamps, 'thumbnail', feed)
+
+# Resolves once the video has finished seeking, so frames are captured as soon as they are ready
+SEEK_SCRIPT = """
+const video = document.querySelector('video');
+const target = arguments[0];
+return new Promise(resolve => {
+    video.addEventListener('seeked', () => resolve(), {once: true});
+    setTimeout(resolve, 5000);
+    video.currentTime = target;
+});
+"""
+
+VIDEO_RECT_SCRIPT = """
+const rect = document.querySelector('video').getBoundingClientRect();
+return {x: rect.left + window.scrollX, y: rect.top + window.scrollY, width: rect.width, height: rect.height};
+"""
+
+FRAME_JPEG_QUALITY = 70
+
+def seek_video(driver, seconds):
+    """Seek the video element and wait for the seeked event"""
+    driver.execute_script(SEEK_SCRIPT, seconds)
+
+def capture_video_frame(driver, clip):
+    """Capture the video area as JPEG bytes through the DevTools protocol"""
+    result = driver.execute_cdp_cmd('Page.captureScreenshot', {
+        'format': 'jpeg',
+        'quality': FRAME_JPEG_QUALITY,
+        'clip': dict(clip, scale=1),
+    })
+    return base64.b64decode(result['data'])
+
+def capture_frame_at(driver, seconds, clip):
+    """Seek to a timestamp and capture the video frame shown there"""
+    seek_video(driver, seconds)
+    return capture_video_frame(driver, clip)
+
+async def process_video_frames(executor, driver, timestamps):
+    """Seek through the video and OCR each captured frame in the shared worker pool"""
+    # The player layout does not change while seeking, so measure it once
+    clip = await asyncio.to_thread(driver.execute_script, VIDEO_RECT_SCRIPT)
+    
+    loop = asyncio.get_running_loop()
+    
+    async def feed(submit, skip):
+        previous_hash = None
+        previous_original = None
+        for idx, (seconds, time_str) in enumerate(timestamps):
+            try:
+                screenshot = await asyncio.to_thread(capture_frame_at, driver, seconds, clip)
+                
+                # Save screenshot
+                queue_write(f"video_frames/frame_{time_str.replace(':', '_')}.jpg", screenshot)
+                
+                # Binarize and hash in the worker pool; the binarized image is reused for OCR
+                prepared = await loop.run_in_executor(executor, prepare_frame_bytes, screenshot)
+            except Exception as e:
+                logger.warning("Error capturing or decoding frame at %s: %s", time_str, e)
+                skip(idx)
+                continue
+            
+            if prepared is None:
+                # Blank frame, nothing to OCR
+                skip(idx)
+                continue
+            frame_hash, binary = prepared
             
-        timestamp_text = timestamp_div.text.strip()
+            # A frame nearly identical to the last OCR'd frame reuses that frame's text.
+            # The reference only moves on OCR'd frames, so slow changes cannot chain
+            # duplicates away from the frame whose text they inherit
+            if previous_hash is not None and hash_distance(frame_hash, previous_hash) <= FRAME_HASH_MAX_DISTANCE:
+                await submit(idx, screenshot, same_as=previous_original)
+            else:
+                previous_hash = frame_hash
+                previous_original = idx
+                await submit(idx, screenshot, binary=binary)
+    
+    frame_timestamps = [time_str for _, time_str in timestamps]
+    return await run_ocr_pipeline(executor, frame_timestamps, 'video', feed)
+
+def extract_timestamps_from_thumbnails(html_content):
+    """Extract timestamps from thumbnails HTML for navigating in the video"""
+    timestamps = []
+    
+    for timestamp_text in select_thumbnail_timestamps(html_content):
+        timestamp_text = timestamp_text.strip()
         
         # Convert timestamp to seconds
-        try:
-            minutes, seconds = map(int, timestamp_text.split(':'))
-            total_seconds = minutes * 60 + seconds
-            timestamps.append((total_seconds, timestamp_text))
-        except:
+        match = TIMESTAMP_RE.fullmatch(timestamp_text)
+        if not match:
             continue
+        minutes, seconds = match.group(1, 2)
+        timestamps.append((int(minutes) * 60 + int(seconds), timestamp_text))
     
     # Sort and remove duplicates
-    timestamps = sorted(list(set(timestamps)), key=lambda x: x[0])
+    timestamps = sorted(set(timestamps), key=lambda x: x[0])
     return timestamps
 
-def extract_attendance_codes(panopto_url, wait_for_login=False):
-    """Main function to extract attendance codes from Panopto"""
+def extract_attendance_codes(panopto_url, wait_for_login=False, debug=False):
+    """Main function to extract attendance codes from Panopto
+    
+    With debug=True, the page HTML and diagnostic screenshots are saved to disk.
+    """
     # Set up Chrome options
     chrome_options = Options()
     # chrome_options.add_argument("--headless")  # Uncomment for headless mode
@@ -144,6 +742,27 @@ def extract_attendance_codes(panopto_url, wait_for_login=False):
     # Initialize the driver
     driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
     
+    # Reuse OCR results from previous runs
+    load_ocr_cache()
+    
+    # Per-image failures are buffered and written out in one go at the end of the run
+    log_buffer = logging.handlers.MemoryHandler(
+        capacity=1000, flushLevel=logging.CRITICAL, target=logging.StreamHandler(),
+    )
+    logger.addHandler(log_buffer)
+    propagate = logger.propagate
+    logger.propagate = False
+    
+    # Decode and OCR are CPU-bound, so run them in processes rather than GIL-bound threads;
+    # thumbnails and video frames share the same pool. Workers are not forked from this
+    # process, so they never inherit the download, writer or resolver threads
+    ocr_executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=OCR_WORKERS,
+        initializer=init_ocr_worker,
+        mp_context=multiprocessing.get_context(OCR_START_METHOD),
+    )
+    found_codes = set()
+    
     try:
         # Navigate to the URL
         print(f"Navigating to {panopto_url}")
@@ -162,9 +781,10 @@ def extract_attendance_codes(panopto_url, wait_for_login=False):
             )
             print("Thumbnail strip loaded successfully")
         except:
-            print("Could not find thumbnail strip. Taking a screenshot to diagnose...")
-            driver.save_screenshot("page_load.png")
-            print("Screenshot saved as page_load.png")
+            print("Could not find thumbnail strip.")
+            if debug:
+                queue_write("page_load.png", driver.get_screenshot_as_png())
+                print("Screenshot saved as page_load.png")
         
         # Wait a bit longer to ensure all thumbnails are loaded
         time.sleep(5)
@@ -173,8 +793,8 @@ def extract_attendance_codes(panopto_url, wait_for_login=False):
         html_content = driver.page_source
         
         # Save the HTML for debugging
-        with open("thumbnails_html.html", "w", encoding="utf-8") as f:
-            f.write(html_content)
+        if debug:
+            queue_write("thumbnails_html.html", html_content.encode("utf-8"))
             print("Saved HTML to thumbnails_html.html")
         
         # Extract image URLs from HTML
@@ -185,24 +805,11 @@ def extract_attendance_codes(panopto_url, wait_for_login=False):
         # Download and process thumbnails
         if image_urls:
             print("Processing thumbnails for attendance codes...")
-            results = []
             
-            # Use a thread pool to process images concurrently
-            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                future_to_url = {executor.submit(download_and_process_image, url_timestamp): url_timestamp for url_timestamp in image_urls}
-                
-                # Use tqdm for a progress bar
-                for future in tqdm(concurrent.futures.as_completed(future_to_url), total=len(image_urls)):
-                    url_timestamp = future_to_url[future]
-                    try:
-                        result = future.result()
-                        if result:
-                            results.append(result)
-                    except Exception as e:
-                        print(f"Error processing {url_timestamp[1]}: {str(e)}")
+            # Download and OCR as separate stages so neither stalls the other
+            results = asyncio.run(process_thumbnails(ocr_executor, image_urls))
             
             # Extract codes from results
-            found_codes = set()
             for timestamp, codes, image_file in results:
                 for code in codes:
                     found_codes.add(code)
@@ -224,9 +831,10 @@ def extract_attendance_codes(panopto_url, wait_for_login=False):
             )
             print("Video player found")
         except:
-            print("Could not find video player element. Taking a screenshot...")
-            driver.save_screenshot("video_player_not_found.png")
-            print("Screenshot saved as video_player_not_found.png")
+            print("Could not find video player element.")
+            if debug:
+                queue_write("video_player_not_found.png", driver.get_screenshot_as_png())
+                print("Screenshot saved as video_player_not_found.png")
             # Try alternative selectors
             try:
                 video_player = driver.find_element(By.TAG_NAME, "video")
@@ -239,46 +847,8 @@ def extract_attendance_codes(panopto_url, wait_for_login=False):
         timestamps = extract_timestamps_from_thumbnails(html_content)
         print(f"Extracted {len(timestamps)} timestamps for navigation")
         
-        # Navigate through timestamps and capture frames
-        video_scan_results = []
-        
-        for seconds, time_str in timestamps:
-            print(f"Checking timestamp {time_str}")
-            
-            # Navigate to timestamp
-            driver.execute_script(f"document.querySelector('video').currentTime = {seconds};")
-            time.sleep(1.5)  # Wait for frame to load
-            
-            # Take screenshot
-            screenshot = driver.find_element(By.TAG_NAME, "video").screenshot_as_png
-            
-            # Save screenshot
-            screenshot_file = f"video_frames/frame_{time_str.replace(':', '_')}.png"
-            os.makedirs("video_frames", exist_ok=True)
-            with open(screenshot_file, "wb") as f:
-                f.write(screenshot)
-            
-            # Process with OCR
-            image = Image.open(io.BytesIO(screenshot))
-            text = pytesseract.image_to_string(image)
-            
-            # Check for attendance codes
-            if re.search(r'attendance code|clicker question', text.lower()):
-                code_pattern = r'(?<![a-zA-Z0-9:/.])[A-Z]{2,}(?: [A-Z]{2,})+(?![a-zA-Z0-9:/.])'
-                matches = re.findall(code_pattern, text)
-                
-                filtered_matches = [
-                    match for match in matches 
-                    if not any(url_term in match.lower() for url_term in ['http', 'www', 'join', 'com'])
-                ]
-                
-                if filtered_matches:
-                    os.makedirs("attendance_codes", exist_ok=True)
-                    for match in filtered_matches:
-                        code_file = f"attendance_codes/video_code_{match.replace(' ', '_')}_{time_str.replace(':', '_')}.png"
-                        image.save(code_file)
-                    
-                    video_scan_results.append((time_str, filtered_matches, screenshot_file))
+        # Navigate through timestamps and capture frames; OCR overlaps with seeking
+        video_scan_results = asyncio.run(process_video_frames(ocr_executor, driver, timestamps))
         
         # Process results from video scanning
         for timestamp, codes, image_file in video_scan_results:
@@ -290,8 +860,17 @@ def extract_attendance_codes(panopto_url, wait_for_login=False):
         return list(found_codes)
     
     finally:
-        # Close the browser
-        driver.quit()
+        try:
+            # Close the browser
+            driver.quit()
+            ocr_executor.shutdown()
+            flush_writes()
+            save_ocr_cache()
+        finally:
+            # Report buffered warnings even if cleanup failed
+            log_buffer.flush()
+            logger.removeHandler(log_buffer)
+            logger.propagate = propagate
 
 if __name__ == "__main__":
     # Replace with your actual Panopto URL
@@ -300,8 +879,11 @@ if __name__ == "__main__":
     # Set to True if the page requires login
     wait_for_login = False
     
+    # Set to True to save the page HTML and diagnostic screenshots
+    debug = False
+    
     # Extract attendance codes
-    codes = extract_attendance_codes(panopto_url, wait_for_login)
+    codes = extract_attendance_codes(panopto_url, wait_for_login, debug)
     
     # Final output
     if codes: